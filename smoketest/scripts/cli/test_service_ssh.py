@@ -19,6 +19,7 @@ import paramiko
 import re
 import unittest
 
+from functools import lru_cache
 from pwd import getpwall
 
 from base_vyostest_shim import VyOSUnitTestSHIM
@@ -38,10 +39,25 @@ key_rsa = '/etc/ssh/ssh_host_rsa_key'
 key_dsa = '/etc/ssh/ssh_host_dsa_key'
 key_ed25519 = '/etc/ssh/ssh_host_ed25519_key'
 
-def get_config_value(key):
-    tmp = read_file(SSHD_CONF)
-    tmp = re.findall(f'\n?{key}\s+(.*)', tmp)
-    return tmp
+@lru_cache(maxsize=None)
+def _key_re(key):
+    return re.compile(r'\n?' + re.escape(key) + r'\s+(.*)')
+
+_MULTI = re.compile(r'^(Port|UseDNS|PasswordAuthentication|LogLevel|'
+                    r'ListenAddress|ClientAliveInterval)\s+(\S.*)$', re.M)
+
+# 'ip vrf pids' output lines are '<pid> <process name>'
+_SSHD_LINE = re.compile(r'^\s*\d+\s+' + re.escape(PROCESS_NAME) + r'\b', re.M)
+
+def get_config_values():
+    # Single pass over sshd_config returning {key: value} - for keys which
+    # occur multiple times the last occurrence is retained
+    return dict(_MULTI.findall(read_file(SSHD_CONF)))
+
+def get_config_value(key, text=None):
+    if text is None:
+        text = read_file(SSHD_CONF)
+    return _key_re(key).findall(text)
 
 class TestServiceSSH(VyOSUnitTestSHIM.TestCase):
     @classmethod
@@ -92,30 +108,25 @@ class TestServiceSSH(VyOSUnitTestSHIM.TestCase):
 
         # commit changes
         self.cli_commit()
+        config = get_config_values()
 
         # Check configured port
-        port = get_config_value('Port')[0]
-        self.assertTrue("1234" in port)
+        self.assertTrue("1234" in config['Port'])
 
         # Check DNS usage
-        dns = get_config_value('UseDNS')[0]
-        self.assertTrue("no" in dns)
+        self.assertTrue("no" in config['UseDNS'])
 
         # Check PasswordAuthentication
-        pwd = get_config_value('PasswordAuthentication')[0]
-        self.assertTrue("no" in pwd)
+        self.assertTrue("no" in config['PasswordAuthentication'])
 
         # Check loglevel
-        loglevel = get_config_value('LogLevel')[0]
-        self.assertTrue("VERBOSE" in loglevel)
+        self.assertTrue("VERBOSE" in config['LogLevel'])
 
         # Check listen address
-        address = get_config_value('ListenAddress')[0]
-        self.assertTrue("127.0.0.1" in address)
+        self.assertTrue("127.0.0.1" in config['ListenAddress'])
 
         # Check keepalive
-        keepalive = get_config_value('ClientAliveInterval')[0]
-        self.assertTrue("100" in keepalive)
+        self.assertTrue("100" in config['ClientAliveInterval'])
 
     def test_ssh_multiple_listen_addresses(self):
         # Check if SSH service can be configured and runs with multiple
@@ -130,14 +141,15 @@ class TestServiceSSH(VyOSUnitTestSHIM.TestCase):
 
         # commit changes
         self.cli_commit()
+        config = read_file(SSHD_CONF)
 
         # Check configured port
-        tmp = get_config_value('Port')
+        tmp = get_config_value('Port', config)
         for port in ports:
             self.assertIn(port, tmp)
 
         # Check listen address
-        tmp = get_config_value('ListenAddress')
+        tmp = get_config_value('ListenAddress', config)
         for address in addresses:
             self.assertIn(address, tmp)
 
@@ -162,7 +174,7 @@ class TestServiceSSH(VyOSUnitTestSHIM.TestCase):
 
         # Check for process in VRF
         tmp = cmd(f'ip vrf pids {vrf}')
-        self.assertIn(PROCESS_NAME, tmp)
+        self.assertRegex(tmp, _SSHD_LINE)
 
         # delete VRF
         self.cli_delete(['vrf', 'name', vrf])
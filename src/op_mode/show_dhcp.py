@@ -16,12 +16,18 @@
 #
 # TODO: merge with show_dhcpv6.py
 
+import calendar
+import socket
+import struct
+import time
+
 from json import dumps
 from argparse import ArgumentParser
 from ipaddress import ip_address
 from tabulate import tabulate
 from sys import exit
-from collections import OrderedDict
+from collections import defaultdict
+from operator import itemgetter
 from datetime import datetime
 
 from isc_dhcp_leases import Lease, IscDhcpLeases
@@ -32,53 +38,60 @@ from vyos.util import is_systemd_service_running
 lease_file = "/config/dhcpd.leases"
 pool_key = "shared-networkname"
 
-lease_display_fields = OrderedDict()
-lease_display_fields['ip'] = 'IP address'
-lease_display_fields['hardware_address'] = 'Hardware address'
-lease_display_fields['state'] = 'State'
-lease_display_fields['start'] = 'Lease start'
-lease_display_fields['end'] = 'Lease expiration'
-lease_display_fields['remaining'] = 'Remaining'
-lease_display_fields['pool'] = 'Pool'
-lease_display_fields['hostname'] = 'Hostname'
+lease_display_fields = {
+    'ip': 'IP address',
+    'hardware_address': 'Hardware address',
+    'state': 'State',
+    'start': 'Lease start',
+    'end': 'Lease expiration',
+    'remaining': 'Remaining',
+    'pool': 'Pool',
+    'hostname': 'Hostname',
+}
 
 lease_valid_states = ['all', 'active', 'free', 'expired', 'released', 'abandoned', 'reset', 'backup']
 
+_VALID_STATES = frozenset(lease_valid_states)
+_SORT_KEYS = frozenset(lease_display_fields)
+
+def verify_pool_exists(config, pool):
+    if not config.exists_effective("service dhcp-server shared-network-name {0}".format(pool)):
+        print("Pool {0} does not exist.".format(pool))
+        exit(0)
+
 def in_pool(lease, pool):
-    if pool_key in lease.sets:
-        if lease.sets[pool_key] == pool:
-            return True
+    return lease.sets.get(pool_key) == pool
 
-    return False
+def ip_to_int(ip):
+    # inet_aton() is considerably faster than ipaddress for the IPv4 case
+    try:
+        return struct.unpack('!I', socket.inet_aton(ip))[0]
+    except OSError:
+        return int(ip_address(ip))
 
-def utc_to_local(utc_dt):
-    return datetime.fromtimestamp((utc_dt - datetime(1970,1,1)).total_seconds())
+def _fmt_local(utc_dt):
+    # isc-dhcp lease times are naive UTC, format them as local time
+    return time.strftime("%Y/%m/%d %H:%M:%S", time.localtime(calendar.timegm(utc_dt.timetuple())))
 
-def get_lease_data(lease):
+def get_lease_data(lease, now):
     data = {}
 
     # isc-dhcp lease times are in UTC so we need to convert them to local time to display
-    try:
-        data["start"] = utc_to_local(lease.start).strftime("%Y/%m/%d %H:%M:%S")
-    except:
-        data["start"] = ""
+    data["start"] = ""
+    if lease.start is not None:
+        data["start"] = _fmt_local(lease.start)
 
-    try:
-        data["end"] = utc_to_local(lease.end).strftime("%Y/%m/%d %H:%M:%S")
-    except:
-        data["end"] = ""
+    data["end"] = ""
+    data["remaining"] = ""
+    if lease.end is not None:
+        data["end"] = _fmt_local(lease.end)
 
-    try:
-        data["remaining"] = lease.end - datetime.utcnow()
+        remaining = lease.end - now
         # negative timedelta prints wrong so bypass it
-        if (data["remaining"].days >= 0):
+        if (remaining.days >= 0):
             # substraction gives us a timedelta object which can't be formatted with strftime
             # so we use str(), split gets rid of the microseconds
-            data["remaining"] = str(data["remaining"]).split('.')[0]
-        else:
-            data["remaining"] = ""
-    except:
-        data["remaining"] = ""
+            data["remaining"] = str(remaining).split('.')[0]
 
     # currently not used but might come in handy
     # todo: parse into datetime string
@@ -94,58 +107,60 @@ def get_lease_data(lease):
     data["state"] = lease.binding_state
     data["ip"] = lease.ip
 
-    try:
-        data["pool"] = lease.sets[pool_key]
-    except:
-        data["pool"] = ""
+    data["pool"] = lease.sets.get(pool_key, "")
 
     return data
 
-def get_leases(config, leases, state, pool=None, sort='ip'):
+def dedupe_leases(leases):
+    # dedupe by IP, newest lease (by start time) overrides older
+    leases_dict = {}
+    for lease in leases:
+        current = leases_dict.get(lease.ip)
+        if current is None or lease.start >= current.start:
+            leases_dict[lease.ip] = lease
+
+    return list(leases_dict.values())
+
+def _load_active_leases():
+    # parse the lease file once and group active leases by pool name
+    by_pool = defaultdict(list)
+    for lease in IscDhcpLeases(lease_file).get():
+        if lease.binding_state == 'active':
+            by_pool[lease.sets.get(pool_key, "")].append(lease)
+
+    return {pool: dedupe_leases(leases) for pool, leases in by_pool.items()}
+
+def get_leases(config, state, pool=None, sort='ip'):
     # get leases from file
     leases = IscDhcpLeases(lease_file).get()
 
     # filter leases by state
     if 'all' not in state:
-        leases = list(filter(lambda x: x.binding_state in state, leases))
+        state = frozenset(state)
+        leases = [lease for lease in leases if lease.binding_state in state]
 
     # filter leases by pool name
     if pool is not None:
-        if config.exists_effective("service dhcp-server shared-network-name {0}".format(pool)):
-            leases = list(filter(lambda x: in_pool(x, pool), leases))
-        else:
-            print("Pool {0} does not exist.".format(pool))
-            exit(0)
+        verify_pool_exists(config, pool)
+        leases = [lease for lease in leases if in_pool(lease, pool)]
 
     # should maybe filter all state=active by lease.valid here?
 
-    # sort by start time to dedupe (newest lease overrides older)
-    leases = sorted(leases, key = lambda lease: lease.start)
-
-    # dedupe by converting to dict
-    leases_dict = {}
-    for lease in leases:
-        # dedupe by IP
-        leases_dict[lease.ip] = lease
-
-    # convert the lease data
-    leases = list(map(get_lease_data, leases_dict.values()))
+    # convert the lease data, using the same point in time for all leases
+    now = datetime.utcnow()
+    leases = [get_lease_data(lease, now) for lease in dedupe_leases(leases)]
 
     # apply output/display sort
     if sort == 'ip':
-        leases = sorted(leases, key = lambda lease: int(ip_address(lease['ip'])))
+        leases.sort(key=lambda lease: ip_to_int(lease['ip']))
     else:
-        leases = sorted(leases, key = lambda lease: lease[sort])
+        leases.sort(key=itemgetter(sort))
 
     return leases
 
 def show_leases(leases):
-    lease_list = []
-    for l in leases:
-        lease_list_params = []
-        for k in lease_display_fields.keys():
-            lease_list_params.append(l[k])
-        lease_list.append(lease_list_params)
+    columns = tuple(lease_display_fields.keys())
+    lease_list = [[l[k] for k in columns] for l in leases]
 
     output = tabulate(lease_list, lease_display_fields.values())
 
@@ -153,15 +168,16 @@ def show_leases(leases):
 
 def get_pool_size(config, pool):
     size = 0
-    subnets = config.list_effective_nodes("service dhcp-server shared-network-name {0} subnet".format(pool))
-    for s in subnets:
-        ranges = config.list_effective_nodes("service dhcp-server shared-network-name {0} subnet {1} range".format(pool, s))
-        for r in ranges:
-            start = config.return_effective_value("service dhcp-server shared-network-name {0} subnet {1} range {2} start".format(pool, s, r))
-            stop = config.return_effective_value("service dhcp-server shared-network-name {0} subnet {1} range {2} stop".format(pool, s, r))
+    # fetch the whole subnet subtree once instead of querying every range boundary
+    base = ['service', 'dhcp-server', 'shared-network-name', pool, 'subnet']
+    subnets = config.get_config_dict(base, effective=True, get_first_key=True)
+    for subnet_config in subnets.values():
+        for range_config in subnet_config.get('range', {}).values():
+            start = range_config['start']
+            stop = range_config['stop']
 
             # Add +1 because both range boundaries are inclusive
-            size += int(ip_address(stop)) - int(ip_address(start)) + 1
+            size += ip_to_int(stop) - ip_to_int(start) + 1
 
     return size
 
@@ -198,13 +214,13 @@ if __name__ == '__main__':
         parser.print_help()
         exit(1)
 
-    if args.sort not in lease_display_fields.keys():
+    if args.sort not in _SORT_KEYS:
         print(f'Invalid sort key, choose from: {list(lease_display_fields.keys())}')
         exit(0)
 
-    if not set(args.state) < set(lease_valid_states):
-            print(f'Invalid lease state, choose from: {lease_valid_states}')
-            exit(0)
+    if not _VALID_STATES.issuperset(args.state):
+        print(f'Invalid lease state, choose from: {lease_valid_states}')
+        exit(0)
 
     # Do nothing if service is not configured
     if not conf.exists_effective('service dhcp-server'):
@@ -216,7 +232,7 @@ if __name__ == '__main__':
         print("WARNING: DHCP server is configured but not started. Data may be stale.")
 
     if args.leases:
-        leases = get_leases(conf, lease_file, args.state, args.pool, args.sort)
+        leases = get_leases(conf, args.state, args.pool, args.sort)
 
         if args.json:
             print(dumps(leases, indent=4))
@@ -228,15 +244,19 @@ if __name__ == '__main__':
 
         # Get relevant pools
         if args.pool:
+            verify_pool_exists(conf, args.pool)
             pools = [args.pool]
         else:
             pools = conf.list_effective_nodes("service dhcp-server shared-network-name")
 
+        # Parse the lease file only once and group active leases by pool
+        active_leases = _load_active_leases()
+
         # Get pool usage stats
         stats = []
         for p in pools:
             size = get_pool_size(conf, p)
-            leases = len(get_leases(conf, lease_file, state='active', pool=p))
+            leases = len(active_leases.get(p, []))
 
             use_percentage = round(leases / size * 100) if size != 0 else 0
 